@@ -2,12 +2,11 @@ import asyncio
 from botframework.connector.auth import JwtTokenValidation
 from flask import Flask, render_template, request, jsonify, Response
 import json
-import psycopg2
 import os
 from datetime import datetime, timezone
 from adapter_with_error_handler import adapter
 from botbuilder.schema import Activity
-from common_function import orchestrate_prompt, db_config
+from common_function import orchestrate_prompt, db_config, pooled_connection
 from incident_bot import IncidentBot
 import logging
 
@@ -49,6 +48,9 @@ app = Flask(__name__)
 loop = asyncio.get_event_loop()
 bot = IncidentBot()
 
+# Web conversation ids are UUIDs generated by chat.html
+MAX_CONVERSATION_ID_LENGTH = 128
+
 # Get context path from environment variable with default to root
 context_path = os.getenv('CONTEXT_PATH', '').rstrip('/')
 
@@ -63,7 +65,7 @@ def health():
     """Health endpoint for Kubernetes probes"""
     try:
         # Test database connection
-        with psycopg2.connect(**db_config) as conn:
+        with pooled_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("SELECT 1")
                 cur.fetchone()
@@ -107,12 +109,19 @@ def chat():
         print(f"Chat endpoint called with context_path: '{context_path}'", flush=True)
         app.logger.info(f"Chat endpoint called with context_path: '{context_path}'")
         user_input = request.json.get('message', '') if request.json else ''
-        print(f"Received input: '{user_input}'")
+        conversation_id = request.json.get('conversation_id') if request.json else None
+        if not isinstance(conversation_id, str) or not conversation_id.strip() or len(conversation_id) > MAX_CONVERSATION_ID_LENGTH:
+            # Anything other than a sane id from chat.html is answered statelessly
+            conversation_id = None
+        else:
+            # Client-chosen ids get their own namespace so they can never address a Teams conversation
+            conversation_id = f"web:{conversation_id}"
+        print(f"Received input: '{user_input}' (conversation: {conversation_id})")
 
         if not user_input.strip():
             return jsonify({'error': 'Empty input'}), 400
 
-        response = orchestrate_prompt(user_input)
+        response = orchestrate_prompt(user_input, conversation_id)
         print(f"Generated response: {response}")
 
         # Ensure result is always a string for the UI
@@ -1,11 +1,15 @@
 import boto3
 import json
-import psycopg2
 import re
 import os
 import requests
+import threading
 import uuid
+from contextlib import nullcontext
 from datetime import datetime, timezone
+from db_pool import PooledConnections
+from geo_index import IncidentGeoIndex, parse_proximity_question
+from conversation_store import ConversationStore, clip_to_tokens
 
 
 # Get AWS region from environment variable with default fallback
@@ -27,6 +31,39 @@ db_config = {
     'password': os.getenv('DB_PASSWORD')
 }
 
+# Connection pool sizing (pool is created lazily, once per process)
+db_pool_min = int(os.getenv('DB_POOL_MIN', '1'))
+db_pool_max = int(os.getenv('DB_POOL_MAX', '5'))
+db_pool_validate_idle_seconds = int(os.getenv('DB_POOL_VALIDATE_IDLE_SECONDS', '30'))
+
+db_pool = PooledConnections(db_config, db_pool_min, db_pool_max, db_pool_validate_idle_seconds)
+pooled_connection = db_pool.connection
+
+# Geo fast path for "incidents within N miles of X" questions
+geo_index_enabled = os.getenv('GEO_INDEX_ENABLED', 'true').lower() == 'true'
+incident_geo_index = IncidentGeoIndex(
+    pooled_connection,
+    window_days=int(os.getenv('GEO_INDEX_WINDOW_DAYS', '90')),
+    cell_degrees=float(os.getenv('GEO_INDEX_CELL_DEGREES', '0.5')),
+    refresh_seconds=int(os.getenv('GEO_INDEX_REFRESH_SECONDS', '60'))
+)
+
+# Multi-turn conversation state, keyed by Teams conversation id or web session id
+conversation_token_budget = int(os.getenv('CONVERSATION_TOKEN_BUDGET', '800'))
+conversation_summary_tokens = int(os.getenv('CONVERSATION_SUMMARY_TOKENS', '150'))
+conversation_store = ConversationStore(
+    max_sessions=int(os.getenv('CONVERSATION_MAX_SESSIONS', '1000')),
+    ttl_seconds=int(os.getenv('CONVERSATION_TTL_SECONDS', '3600'))
+)
+
+PROMPT_PREFIX = re.compile(r"^\[(?:database|general|api)\]", re.IGNORECASE)
+# Explicit edits of the previous query, e.g. "same as before but only for OEM1"; other
+# follow-ups are generated from the conversation context instead
+FOLLOW_UP_EDIT = re.compile(
+    r"\b(?:same as (?:before|above|last time)|same query|(?:previous|last) (?:query|sql)|but only|instead of)\b",
+    re.IGNORECASE
+)
+
 SCHEMA_DESCRIPTION = """
 Table: incident
 Columns:
@@ -65,48 +102,107 @@ vendor_company_cd,
 incident_description
 """
 
-def orchestrate_prompt(user_input):
+def orchestrate_prompt(user_input, conversation_id=None):
     user_input = user_input.strip()
-    if user_input.lower().startswith("[database]"):
-        print(f"Processing database prompt: {user_input}", flush=True)  # Debugging output
-        return handle_database_prompt(user_input)
-    elif user_input.lower().startswith("[general]"):
-        print(f"Processing general prompt: {user_input}", flush=True)
-        return handle_general_prompt(user_input)
-    elif user_input.lower().startswith("[api]"):
-        print(f"Processing API prompt: {user_input}", flush=True)
-        return handle_api_prompt(user_input)
-    else:
-        print(f"Unknown prompt type: {user_input}", flush=True)
-        return {'llm_sql': None, 'result': "Unknown prompt type. Please use [Database], [General], or [API] prefix."}
+    session = conversation_store.get(conversation_id) if conversation_id else None
+    with session.lock if session is not None else nullcontext():
+        # Follow-ups may drop the prefix; they continue in the mode of the previous turn
+        if session is not None and session.last_mode and not PROMPT_PREFIX.match(user_input):
+            user_input = f"[{session.last_mode}] {user_input}"
+        if user_input.lower().startswith("[database]"):
+            print(f"Processing database prompt: {user_input}", flush=True)  # Debugging output
+            return handle_database_prompt(user_input, session)
+        elif user_input.lower().startswith("[general]"):
+            print(f"Processing general prompt: {user_input}", flush=True)
+            return handle_general_prompt(user_input, session)
+        elif user_input.lower().startswith("[api]"):
+            print(f"Processing API prompt: {user_input}", flush=True)
+            return handle_api_prompt(user_input)
+        else:
+            print(f"Unknown prompt type: {user_input}", flush=True)
+            return {'llm_sql': None, 'result': "Unknown prompt type. Please use [Database], [General], or [API] prefix."}
 
-def handle_database_prompt(user_input):
+def handle_database_prompt(user_input, session=None):
     """Handle database queries"""
     question = re.sub(r"^\[Database\]\s*", "", user_input, flags=re.IGNORECASE)
-    llm_response = get_sql_from_llm(question)
+    geo_response = handle_proximity_question(question)
+    if geo_response is not None:
+        if session is not None:
+            # The geo query is parameterized, so there is no SQL to edit on a follow-up
+            session.last_sql = None
+            record_turn(session, question, geo_response['llm_sql'], 'Database')
+        return geo_response
+    if session is not None and session.last_sql and FOLLOW_UP_EDIT.search(question):
+        print(f"Revising previous SQL: {session.last_sql}", flush=True)
+        llm_response = revise_sql_with_llm(session.last_sql, question)
+    else:
+        llm_response = get_sql_from_llm(question, session.render_context() if session is not None else "")
     sql = extract_sql_from_response(llm_response)
     columns, result = execute_sql(sql)
+    if session is not None:
+        # A failed query is not worth editing; keep the last one that ran
+        if columns or not str(result[0]).startswith("Error:"):
+            session.last_sql = sql
+        record_turn(session, question, f"SQL: {sql}", 'Database')
+    return {
+        'llm_sql': sql,
+        'result': format_sql_result(columns, result)
+    }
+
+def handle_proximity_question(question):
+    """Answer proximity questions from the geo index; returns None to fall back to LLM-generated SQL"""
+    if not geo_index_enabled:
+        return None
+    proximity = parse_proximity_question(question)
+    if proximity is None or not incident_geo_index.covers(proximity['since']):
+        return None
+    center = proximity['coordinates'] or geocode_place_with_llm(proximity['place'])
+    if center is None:
+        return None
+    try:
+        incident_geo_index.refresh()
+    except Exception as e:
+        print(f"Geo index refresh failed, falling back to LLM SQL: {e}", flush=True)
+        return None
+
+    print(f"Answering from geo index: {proximity}", flush=True)
+    incident_ids = incident_geo_index.query_radius(center[0], center[1], proximity['radius_miles'], proximity['since'])
+    sql = "SELECT * FROM incident WHERE incident_id = ANY(%s) ORDER BY incident_date DESC"
+    display_sql = (
+        f"-- geo index: {len(incident_ids)} incidents within {proximity['radius_miles']:g} miles of "
+        f"{proximity['place']} ({center[0]:.4f}, {center[1]:.4f}) since {proximity['since'].isoformat()}\n{sql}"
+    )
+    if not incident_ids:
+        return {'llm_sql': display_sql, 'result': "No incidents found."}
+    columns, result = execute_sql(sql, (incident_ids,))
+    return {
+        'llm_sql': display_sql,
+        'result': format_sql_result(columns, result)
+    }
+
+def format_sql_result(columns, result):
     if columns:
         result_str = "\t".join(columns) + "\n\n"
         for row in result:
             result_str += "\t".join(str(x) for x in row) + "\n\n"
     else:
         result_str = result[0]
-    return {
-        'llm_sql': sql,
-        'result': result_str
-    }
+    return result_str
 
-def handle_general_prompt(user_input):
+def handle_general_prompt(user_input, session=None):
     question = re.sub(r"^\[General\]\s*", "", user_input, flags=re.IGNORECASE)
+    context = session.render_context() if session is not None else ""
+    content = f"Conversation so far:\n{context}\n\n{question}" if context else question
     body = {
         "anthropic_version": "bedrock-2023-05-31",
         "max_tokens": 100,
-        "messages": [{"role": "user", "content": question}]
+        "messages": [{"role": "user", "content": content}]
     }
     response = client.invoke_model(modelId=model_id, body=json.dumps(body))
     result = json.loads(response['body'].read())
     answer = result['content'][0]['text'].strip()
+    if session is not None:
+        record_turn(session, question, answer, 'General')
     return {
         'llm_sql': None,
         'result': answer
@@ -128,10 +224,49 @@ def handle_api_prompt(user_input):
     else:
         return {'llm_sql': None, 'result': f"API '{api_name}' not supported."}
 
-def get_sql_from_llm(question):
+def record_turn(session, question, answer, mode):
+    """Append a turn and fold turns that no longer fit the token budget into the running summary"""
+    session.last_mode = mode
+    session.add_turn("User", clip_to_tokens(question, conversation_token_budget // 4))
+    session.add_turn("Assistant", clip_to_tokens(answer, conversation_token_budget // 4))
+    evicted = session.pop_turns_over_budget(conversation_token_budget)
+    if evicted:
+        # Summarize off the request path; the thread waits for this turn to release session.lock,
+        # and the next turn of the conversation waits for the summary
+        threading.Thread(target=compact_session, args=(session, evicted), daemon=True).start()
+
+def compact_session(session, evicted):
+    with session.lock:
+        session.summary = summarize_turns_with_llm(session.summary, evicted)
+
+def summarize_turns_with_llm(summary, turns):
+    transcript = "\n".join(f"{role}: {text}" for role, text in turns)
+    prompt = (
+        "Update the running summary of a conversation about an incident database.\n"
+        "Keep the filters, company codes, dates and other details that later questions may refer to.\n"
+        f"Current summary: {summary or '(none)'}\n"
+        f"New turns:\n{transcript}\n"
+        f"Return only the updated summary, in under {conversation_summary_tokens} tokens."
+    )
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": conversation_summary_tokens,
+        "messages": [{"role": "user", "content": prompt}]
+    }
+    try:
+        response = client.invoke_model(modelId=model_id, body=json.dumps(body))
+        result = json.loads(response['body'].read())
+        return clip_to_tokens(result['content'][0]['text'].strip(), conversation_summary_tokens)
+    except Exception as e:
+        print(f"Conversation summary failed, keeping the most recent text: {e}", flush=True)
+        combined = f"{summary}\n{transcript}".strip()
+        return combined[-conversation_summary_tokens * 4:]
+
+def get_sql_from_llm(question, context=""):
     instruction = (
         f"{SCHEMA_DESCRIPTION}\n"
-        "Convert this question to a Postgres SQL query using the schema above: "
+        + (f"Conversation so far:\n{context}\n" if context else "")
+        + "Convert this question to a Postgres SQL query using the schema above: "
         f"{question}\n"
         "When generating SQL for date intervals, always use single quotes around the interval value. "
         "Example: INTERVAL '1 week'"
@@ -145,6 +280,26 @@ def get_sql_from_llm(question):
     result = json.loads(response['body'].read())
     return result['content'][0]['text'].strip()
 
+def revise_sql_with_llm(previous_sql, question):
+    """Edit the previous query for a follow-up instead of generating one from the conversation"""
+    instruction = (
+        f"{SCHEMA_DESCRIPTION}\n"
+        f"Previous Postgres SQL query:\n{previous_sql}\n"
+        f"Modify the previous query for this follow-up request: {question}\n"
+        "Keep everything else in the previous query unchanged and return only the SQL. "
+        "When generating SQL for date intervals, always use single quotes around the interval value. "
+        "Example: INTERVAL '1 week'"
+    )
+    # The revision repeats the whole previous query plus the edit, so it needs more room than a fresh query
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 300,
+        "messages": [{"role": "user", "content": instruction}]
+    }
+    response = client.invoke_model(modelId=model_id, body=json.dumps(body))
+    result = json.loads(response['body'].read())
+    return result['content'][0]['text'].strip()
+
 def extract_sql_from_response(response):
     match = re.search(r"```sql\s*(.*?)```", response, re.DOTALL | re.IGNORECASE)
     if match:
@@ -154,11 +309,11 @@ def extract_sql_from_response(response):
         return match.group(0).strip()
     return response.strip()
 
-def execute_sql(sql):
+def execute_sql(sql, params=None):
     try:
-        with psycopg2.connect(**db_config) as conn:
+        with pooled_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute(sql)
+                cur.execute(sql, params)
                 if cur.description:
                     columns = [desc[0] for desc in cur.description]
                     rows = cur.fetchall()
@@ -168,6 +323,47 @@ def execute_sql(sql):
     except Exception as e:
         return [], [f"Error: {e}"]
 
+# Answers from the geocoding prompt, including "unknown place"; Bedrock errors are never cached
+GEOCODE_CACHE_SIZE = 1024
+_geocode_cache = {}
+_geocode_cache_lock = threading.Lock()
+
+def geocode_place_with_llm(place):
+    """Resolve a place name to (latitude, longitude); None if the LLM cannot place it"""
+    key = place.strip().lower()
+    with _geocode_cache_lock:
+        if key in _geocode_cache:
+            return _geocode_cache[key]
+    prompt = (
+        f'Return the latitude and longitude of the center of this place: {place}\n'
+        'Return only JSON in the form {"latitude": <number>, "longitude": <number>}. '
+        'If the place is unknown or ambiguous, return {}.'
+    )
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 50,
+        "messages": [{"role": "user", "content": prompt}]
+    }
+    try:
+        response = client.invoke_model(modelId=model_id, body=json.dumps(body))
+        result = json.loads(response['body'].read())
+        completion = result['content'][0]['text'].strip()
+    except Exception as e:
+        print(f"Could not geocode '{place}': {e}", flush=True)
+        return None
+    try:
+        match = re.search(r'({.*})', completion, re.DOTALL)
+        location = json.loads(match.group(1)) if match else {}
+        center = float(location['latitude']), float(location['longitude'])
+    except (ValueError, KeyError, TypeError):
+        print(f"LLM could not geocode '{place}': {completion}", flush=True)
+        center = None
+    with _geocode_cache_lock:
+        if len(_geocode_cache) >= GEOCODE_CACHE_SIZE:
+            _geocode_cache.pop(next(iter(_geocode_cache)))
+        _geocode_cache[key] = center
+    return center
+
 
 def build_api_payload_with_llm(api_name, question):
     prompt = (
@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token), good enough for budgeting prompts"""
+    return (len(text) + 3) // 4 if text else 0
+
+
+def clip_to_tokens(text, max_tokens):
+    max_chars = max_tokens * 4
+    return text if len(text) <= max_chars else text[:max_chars - 3] + "..."
+
+
+class ConversationSession:
+    """Per-conversation state: a summary of older turns, recent turns and the last generated SQL"""
+
+    def __init__(self):
+        self.summary = ""
+        self.turns = []
+        self.last_sql = None
+        self.last_mode = None
+        # Serializes turns of the same conversation so compaction never races
+        self.lock = threading.Lock()
+
+    def turn_tokens(self):
+        return sum(estimate_tokens(text) for _, text in self.turns)
+
+    def add_turn(self, role, text):
+        self.turns.append((role, text))
+
+    def pop_turns_over_budget(self, token_budget, target_tokens=None):
+        """Once the recent turns exceed token_budget, remove and return the oldest until they fit target_tokens
+
+        Compacting down to half the budget by default means the caller only
+        has to summarize every few turns rather than on every turn.
+        """
+        if self.turn_tokens() <= token_budget:
+            return []
+        target_tokens = token_budget // 2 if target_tokens is None else target_tokens
+        evicted = []
+        # Evict whole exchanges, and always keep the latest one even if it alone exceeds the target
+        while len(self.turns) > 2 and self.turn_tokens() > target_tokens:
+            evicted.extend(self.turns[:2])
+            del self.turns[:2]
+        return evicted
+
+    def render_context(self):
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of the earlier conversation: {self.summary}")
+        for role, text in self.turns:
+            parts.append(f"{role}: {text}")
+        return "\n".join(parts)
+
+
+class ConversationStore:
+    """Bounded LRU store of sessions; sessions idle for longer than ttl_seconds are dropped"""
+
+    def __init__(self, max_sessions=1000, ttl_seconds=3600):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, conversation_id):
+        """Return the session for conversation_id, creating it if missing or expired"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._sessions.pop(conversation_id, None)
+            session = entry[0] if entry else ConversationSession()
+            self._sessions[conversation_id] = (session, now)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return session
+
+    def discard(self, conversation_id):
+        with self._lock:
+            self._sessions.pop(conversation_id, None)
+
+    def _expire(self, now):
+        # Least recently used sessions sit at the front, so stop at the first live one
+        while self._sessions:
+            conversation_id, (_, last_used) = next(iter(self._sessions.items()))
+            if now - last_used <= self.ttl_seconds:
+                break
+            del self._sessions[conversation_id]
@@ -0,0 +1,77 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+
+class PooledConnections:
+    """Lazily created, thread-safe Postgres connection pool
+
+    Connections that sat idle for longer than validate_idle_seconds are
+    checked with SELECT 1 when borrowed, so connections dropped by a failover
+    or an idle timeout are replaced instead of failing the caller's query.
+    """
+
+    def __init__(self, db_config, minconn=1, maxconn=5, validate_idle_seconds=30):
+        self.db_config = db_config
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.validate_idle_seconds = validate_idle_seconds
+        self._pool = None
+        self._lock = threading.Lock()
+        self._returned_at = {}
+
+    def get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadedConnectionPool(self.minconn, self.maxconn, **self.db_config)
+        return self._pool
+
+    def _is_usable(self, conn):
+        if conn.closed:
+            return False
+        returned_at = self._returned_at.pop(conn, None)
+        if returned_at is None or time.monotonic() - returned_at < self.validate_idle_seconds:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            print(f"Discarding stale pooled connection: {e}", flush=True)
+            return False
+
+    def _borrow(self):
+        pool = self.get_pool()
+        # Every idle connection may be stale after a failover; one more attempt always opens a new one
+        for _ in range(self.maxconn + 1):
+            conn = pool.getconn()
+            if self._is_usable(conn):
+                return conn
+            pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError("Could not get a usable connection from the pool")
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection from the pool; commits on success, rolls back on error"""
+        pool = self.get_pool()
+        conn = self._borrow()
+        try:
+            with conn:
+                yield conn
+        finally:
+            if conn.closed:
+                self._returned_at.pop(conn, None)
+                pool.putconn(conn, close=True)
+            else:
+                self._returned_at[conn] = time.monotonic()
+                pool.putconn(conn)
+
+    def closeall(self):
+        if self._pool is not None:
+            self._pool.closeall()
+            self._returned_at.clear()
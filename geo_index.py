@@ -0,0 +1,237 @@
+import math
+import re
+import threading
+import time
+from array import array
+from datetime import date, datetime, timedelta, timezone
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_KM = 0.621371
+MILES_PER_DEGREE_LAT = 69.0
+
+# "[show me] [all] incidents within 5 miles of Chicago [this week]"
+PROXIMITY_QUESTION = re.compile(
+    r"^(?:(?:show|list|find|get|give)\s+(?:me\s+)?)?(?:all\s+)?(?:the\s+)?(?:recent\s+)?incidents?\s+"
+    r"(?:within|in)\s+(?:a\s+)?(?P<radius>\d+(?:\.\d+)?)\s*-?\s*(?P<unit>miles?|mi|kilometers?|km)\s+"
+    r"(?:radius\s+)?(?:of|from|around)\s+(?P<place>.+?)"
+    r"(?:\s+(?P<period>today|this\s+week|this\s+month|"
+    r"(?:in\s+the\s+)?(?:last|past)\s+(?:week|month|(?P<days>\d+)\s+days?)))?"
+    r"\s*[.?!]?$",
+    re.IGNORECASE
+)
+COORDINATES = re.compile(r"^\(?\s*(-?\d{1,2}(?:\.\d+)?)\s*,\s*(-?\d{1,3}(?:\.\d+)?)\s*\)?$")
+# Anything that looks like an extra filter ("Chicago for OEM1") is left to the LLM
+PLACE_NAME = re.compile(r"^(?:\d{5}|[A-Za-z][A-Za-z .,'-]*)$")
+EXTRA_FILTER_WORDS = re.compile(r"\b(?:for|with|where|and|by|that|whose|status|type|brand|oem|company)\b", re.IGNORECASE)
+
+
+def parse_proximity_question(question, now=None):
+    """Return {'radius_miles', 'place', 'coordinates', 'since'} for a proximity question, otherwise None"""
+    match = PROXIMITY_QUESTION.match(question.strip())
+    if not match or not match.group('period'):
+        # Without a time filter the question is not bounded by the index window
+        return None
+    place = match.group('place').strip().rstrip(',')
+    coordinates = None
+    coord_match = COORDINATES.match(place)
+    if coord_match:
+        coordinates = (float(coord_match.group(1)), float(coord_match.group(2)))
+    elif not PLACE_NAME.match(place) or EXTRA_FILTER_WORDS.search(place):
+        return None
+
+    radius = float(match.group('radius'))
+    if match.group('unit').lower().startswith('k'):
+        radius *= MILES_PER_KM
+
+    now = now or datetime.now(timezone.utc)
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    period = re.sub(r"\s+", " ", match.group('period').lower())
+    if period == "today":
+        since = midnight
+    elif period == "this week":
+        since = midnight - timedelta(days=midnight.weekday())
+    elif period == "this month":
+        since = midnight.replace(day=1)
+    elif period.endswith("week"):
+        since = now - timedelta(days=7)
+    elif period.endswith("month"):
+        since = now - timedelta(days=30)
+    else:
+        since = now - timedelta(days=int(match.group('days')))
+
+    return {
+        'radius_miles': radius,
+        'place': place,
+        'coordinates': coordinates,
+        'since': since
+    }
+
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _to_epoch(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day, tzinfo=timezone.utc).timestamp()
+    return None
+
+
+class IncidentGeoIndex:
+    """Grid index over the coordinates of recent incidents
+
+    Coordinates and incident dates live in parallel arrays indexed by slot;
+    each grid cell holds the slots whose point falls inside it. The index is
+    refreshed incrementally from Postgres using modifid_dt as a watermark.
+    """
+
+    def __init__(self, connection_factory, window_days=90, cell_degrees=0.5, refresh_seconds=60):
+        self.connection_factory = connection_factory
+        self.window_days = window_days
+        self.cell_degrees = cell_degrees
+        self.n_cols = int(math.ceil(360.0 / cell_degrees))
+        self.refresh_seconds = refresh_seconds
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.lat = array('d')
+        self.lon = array('d')
+        self.when = array('d')
+        self.ids = []
+        self.slot_by_id = {}
+        self.cells = {}
+        self.free_slots = []
+        self.watermark = None
+        self.last_refresh = None
+
+    def __len__(self):
+        return len(self.slot_by_id)
+
+    def window_start(self):
+        return datetime.now(timezone.utc) - timedelta(days=self.window_days)
+
+    def covers(self, since):
+        return since >= self.window_start()
+
+    def _row(self, lat):
+        return int((lat + 90.0) // self.cell_degrees)
+
+    def _column(self, lon):
+        return int((lon + 180.0) // self.cell_degrees)
+
+    def _cell(self, lat, lon):
+        # Longitude 180 and -180 are the same meridian; wrap so storage and lookup use the same columns
+        return (self._row(lat), self._column(lon) % self.n_cols)
+
+    def refresh(self, force=False):
+        """Pull incidents modified since the last refresh; a no-op within refresh_seconds of the last one"""
+        if not force and self.last_refresh is not None and time.monotonic() - self.last_refresh < self.refresh_seconds:
+            return
+        with self.lock:
+            if not force and self.last_refresh is not None and time.monotonic() - self.last_refresh < self.refresh_seconds:
+                return
+            cutoff = self.window_start()
+            watermark = self.watermark
+            with self.connection_factory() as conn:
+                with conn.cursor() as cur:
+                    if watermark is None:
+                        # Seed the watermark from the column itself (taken before the load so nothing
+                        # modified during it is missed), so later comparisons never mix naive and aware datetimes
+                        cur.execute("SELECT max(modifid_dt) FROM incident")
+                        watermark = cur.fetchone()[0]
+                        cur.execute(
+                            "SELECT incident_id, latitude, longitude, incident_date, modifid_dt FROM incident "
+                            "WHERE incident_date >= %s",
+                            (cutoff,)
+                        )
+                    else:
+                        # >= so rows sharing the watermark timestamp are not missed; upserts are idempotent
+                        cur.execute(
+                            "SELECT incident_id, latitude, longitude, incident_date, modifid_dt FROM incident "
+                            "WHERE modifid_dt >= %s",
+                            (watermark,)
+                        )
+                    rows = cur.fetchall()
+            # Only advance the watermark once the rows are in hand; a failed first load is retried in full
+            for incident_id, lat, lon, incident_date, modifid_dt in rows:
+                self._upsert(incident_id, lat, lon, _to_epoch(incident_date))
+                if modifid_dt is not None and (watermark is None or modifid_dt > watermark):
+                    watermark = modifid_dt
+            self.watermark = watermark
+            self._evict_before(cutoff.timestamp())
+            self.last_refresh = time.monotonic()
+            print(f"Geo index refreshed: {len(rows)} changed rows, {len(self)} incidents indexed", flush=True)
+
+    def _upsert(self, incident_id, lat, lon, when):
+        self._remove(incident_id)
+        if lat is None or lon is None or when is None:
+            return
+        lat, lon = float(lat), float(lon)
+        if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+            return
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.lat[slot], self.lon[slot], self.when[slot] = lat, lon, when
+            self.ids[slot] = incident_id
+        else:
+            slot = len(self.ids)
+            self.lat.append(lat)
+            self.lon.append(lon)
+            self.when.append(when)
+            self.ids.append(incident_id)
+        self.slot_by_id[incident_id] = slot
+        self.cells.setdefault(self._cell(lat, lon), array('l')).append(slot)
+
+    def _remove(self, incident_id):
+        slot = self.slot_by_id.pop(incident_id, None)
+        if slot is None:
+            return
+        cell = self._cell(self.lat[slot], self.lon[slot])
+        slots = self.cells[cell]
+        slots.remove(slot)
+        if not slots:
+            del self.cells[cell]
+        self.ids[slot] = None
+        self.free_slots.append(slot)
+
+    def _evict_before(self, cutoff_epoch):
+        expired = [self.ids[slot] for slot in self.slot_by_id.values() if self.when[slot] < cutoff_epoch]
+        for incident_id in expired:
+            self._remove(incident_id)
+
+    def query_radius(self, lat, lon, radius_miles, since=None):
+        """Incident ids within radius_miles of (lat, lon), nearest first"""
+        since_epoch = _to_epoch(since) if since is not None else float('-inf')
+        lat_span = radius_miles / MILES_PER_DEGREE_LAT
+        # Longitude degrees shrink towards the poles; size the box for the widest latitude it touches
+        max_abs_lat = min(90.0, abs(lat) + lat_span)
+        cos_lat = math.cos(math.radians(max_abs_lat))
+        lon_span = 180.0 if cos_lat < 1e-6 else min(180.0, radius_miles / (MILES_PER_DEGREE_LAT * cos_lat))
+
+        row_lo, row_hi = self._row(max(-90.0, lat - lat_span)), self._row(min(90.0, lat + lat_span))
+        col_lo, col_hi = self._column(lon - lon_span), self._column(lon + lon_span)
+        if col_hi - col_lo + 1 >= self.n_cols:
+            cols = range(self.n_cols)
+        else:
+            # Wrap across the antimeridian
+            cols = [c % self.n_cols for c in range(col_lo, col_hi + 1)]
+
+        matches = []
+        with self.lock:
+            for row in range(row_lo, row_hi + 1):
+                for col in cols:
+                    for slot in self.cells.get((row, col), ()):
+                        if self.when[slot] < since_epoch:
+                            continue
+                        distance = haversine_miles(lat, lon, self.lat[slot], self.lon[slot])
+                        if distance <= radius_miles:
+                            matches.append((distance, self.ids[slot]))
+        matches.sort(key=lambda m: m[0])
+        return [incident_id for _, incident_id in matches]
@@ -7,8 +7,10 @@ from common_function import orchestrate_prompt
 class IncidentBot(ActivityHandler):
     async def on_message_activity(self, turn_context: TurnContext):
         text = turn_context.activity.text
-        print(f"@@@@@@@@@@@@@ Received message: {text}", flush=True)  # Debugging output
-        response = orchestrate_prompt(text)
+        conversation = turn_context.activity.conversation
+        conversation_id = f"teams:{conversation.id}" if conversation and conversation.id else None
+        print(f"@@@@@@@@@@@@@ Received message: {text} (conversation: {conversation_id})", flush=True)  # Debugging output
+        response = orchestrate_prompt(text, conversation_id)
         print(f"&&&&&&&&&&&&&&&& Received response: {response}", flush=True)
         if isinstance(response.get('result'), dict):
             response['result'] = json.dumps(response['result'], indent=2)
@@ -30,7 +32,9 @@ class IncidentBot(ActivityHandler):
                             "- **[Database]:** Converts natural language to SQL and queries the DB.\n\n"
                             "  _Example:_ [Database] Show all incidents from last week.\n"
                             "- **[API]:** Uses Bedrock LLM to build a JSON payload, calls the specified API, and returns the response.\n\n"
-                            "  _Example:_ [API][Create Incident API]: Create an incident for company code OEM1 and VIN 1GYKPGRS4MZ153770."
+                            "  _Example:_ [API][Create Incident API]: Create an incident for company code OEM1 and VIN 1GYKPGRS4MZ153770.\n\n"
+                            "Follow-ups keep the context of the conversation and can drop the prefix.\n\n"
+                            "  _Example:_ Same as before but only for OEM1"
                         ),
                         text_format="markdown"
                     )
@@ -0,0 +1,167 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from geo_index import IncidentGeoIndex, haversine_miles, parse_proximity_question
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.result = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.db.queries.append((sql, params))
+        if self.db.fail_on is not None and self.db.fail_on in sql:
+            self.db.fail_on = None
+            raise RuntimeError("statement timeout")
+        if sql.startswith("SELECT max(modifid_dt)"):
+            stamps = [row[4] for row in self.db.rows if row[4] is not None]
+            self.result = [(max(stamps) if stamps else None,)]
+        elif "WHERE incident_date >= %s" in sql:
+            self.result = [row for row in self.db.rows if row[3] >= params[0].replace(tzinfo=None)]
+        else:
+            self.result = [row for row in self.db.rows if row[4] is not None and row[4] >= params[0]]
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return list(self.result)
+
+
+class FakeDatabase:
+    """Stands in for pooled_connection; rows are (incident_id, lat, lon, incident_date, modifid_dt)
+    with naive timestamps, as Postgres timestamp columns return them"""
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.queries = []
+        # The next statement containing this text raises, as a timeout or dropped connection would
+        self.fail_on = None
+
+    @contextmanager
+    def connection(self):
+        yield self
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+NOW = datetime.now(timezone.utc).replace(tzinfo=None)
+CHICAGO = (41.8781, -87.6298)
+
+
+@pytest.fixture
+def db():
+    return FakeDatabase([
+        (1, 41.8800, -87.6300, NOW - timedelta(days=1), NOW - timedelta(hours=2)),
+        (2, 41.9500, -87.6500, NOW - timedelta(days=10), NOW - timedelta(hours=2)),
+        (3, 40.7128, -74.0060, NOW - timedelta(days=1), NOW - timedelta(hours=1)),
+        (4, None, None, NOW - timedelta(days=1), NOW - timedelta(hours=1)),
+    ])
+
+
+def test_radius_query_returns_nearest_first(db):
+    index = IncidentGeoIndex(db.connection)
+    index.refresh()
+
+    assert len(index) == 3
+    assert index.query_radius(*CHICAGO, 10) == [1, 2]
+    assert index.query_radius(*CHICAGO, 10, since=datetime.now(timezone.utc) - timedelta(days=7)) == [1]
+    assert index.query_radius(*CHICAGO, 1) == [1]
+
+
+def test_incremental_refresh_upserts_and_evicts(db):
+    index = IncidentGeoIndex(db.connection, window_days=30)
+    index.refresh()
+
+    later = NOW + timedelta(minutes=5)
+    db.rows = [
+        # Incident 1 moved to New York, incident 2 fell out of the window, incident 5 is new
+        (1, 40.7200, -74.0000, NOW - timedelta(days=1), later),
+        (2, 41.9500, -87.6500, NOW - timedelta(days=60), later),
+        (5, 41.8700, -87.6200, NOW, later),
+    ]
+    index.refresh(force=True)
+
+    assert "modifid_dt >= %s" in db.queries[-1][0]
+    assert index.watermark == later
+    assert len(index) == 3
+    assert index.query_radius(*CHICAGO, 10) == [5]
+    assert sorted(index.query_radius(40.7128, -74.0060, 5)) == [1, 3]
+
+
+def test_failed_first_load_is_retried_in_full(db):
+    index = IncidentGeoIndex(db.connection)
+    # max(modifid_dt) succeeds, the full load after it fails
+    db.fail_on = "WHERE incident_date >= %s"
+    with pytest.raises(RuntimeError):
+        index.refresh()
+    assert index.watermark is None
+
+    index.refresh()
+    assert "WHERE incident_date >= %s" in db.queries[-1][0]
+    assert len(index) == 3
+    assert index.query_radius(*CHICAGO, 10) == [1, 2]
+
+
+def test_refresh_with_no_modified_rows_keeps_full_load(db):
+    db.rows = []
+    index = IncidentGeoIndex(db.connection)
+    index.refresh()
+    assert index.watermark is None
+
+    db.rows = [(7, 41.88, -87.63, NOW, NOW)]
+    index.refresh(force=True)
+    assert "WHERE incident_date >= %s" in db.queries[-1][0]
+    assert index.query_radius(*CHICAGO, 5) == [7]
+
+
+def test_antimeridian_points_are_found_from_both_sides():
+    db = FakeDatabase([
+        (1, 0.0, 180.0, NOW, NOW),
+        (2, 0.0, -180.0, NOW, NOW),
+        (3, 0.0, 179.99, NOW, NOW),
+    ])
+    index = IncidentGeoIndex(db.connection)
+    index.refresh()
+
+    assert sorted(index.query_radius(0.0, -179.99, 5)) == [1, 2, 3]
+    assert sorted(index.query_radius(0.0, 179.95, 5)) == [1, 2, 3]
+
+
+def test_haversine_miles():
+    # Chicago to New York is roughly 712 miles
+    assert haversine_miles(*CHICAGO, 40.7128, -74.0060) == pytest.approx(712, abs=5)
+
+
+def test_parse_proximity_question():
+    now = datetime(2026, 10, 21, 15, 30, tzinfo=timezone.utc)  # a Wednesday
+
+    parsed = parse_proximity_question("Show me incidents within 5 miles of Chicago this week", now)
+    assert parsed['radius_miles'] == 5
+    assert parsed['place'] == "Chicago"
+    assert parsed['coordinates'] is None
+    assert parsed['since'] == datetime(2026, 10, 19, tzinfo=timezone.utc)
+
+    parsed = parse_proximity_question("incidents within 10 km of 41.88, -87.63 in the last 3 days?", now)
+    assert parsed['coordinates'] == (41.88, -87.63)
+    assert parsed['radius_miles'] == pytest.approx(6.214, abs=0.001)
+    assert parsed['since'] == now - timedelta(days=3)
+
+
+@pytest.mark.parametrize("question", [
+    "incidents within 5 miles of Chicago",
+    "incidents within 5 miles of Chicago for OEM1 this week",
+    "how many claims were filed this week",
+])
+def test_parse_proximity_question_falls_back(question):
+    assert parse_proximity_question(question) is None